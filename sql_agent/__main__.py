@@ -1,3 +1,8 @@
+from dotenv import load_dotenv
+
+# Load .env before importing the agent so per-stage model overrides apply.
+load_dotenv()
+
 from common.server import A2AServer
 from common.types import AgentCard, AgentCapabilities, AgentSkill, MissingAPIKeyError
 from task_manager import AgentTaskManager
@@ -5,9 +10,7 @@ from agent import SQLAgent
 import click
 import os
 import logging
-from dotenv import load_dotenv
-
-load_dotenv()
+import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,12 +39,16 @@ def main(host, port):
             capabilities=capabilities,
             skills=[skill],
         )
+        agent = SQLAgent()
         server = A2AServer(
             agent_card=agent_card,
-            task_manager=AgentTaskManager(agent=SQLAgent()),
+            task_manager=AgentTaskManager(agent=agent),
             host=host,
             port=port,
         )
+        # Build the pipeline while the server starts listening instead of on
+        # the first request, inside the server's event loop.
+        threading.Thread(target=agent.warm_up, daemon=True).start()
         server.start()
     except MissingAPIKeyError as e:
         logger.error(f"Error: {e}")
@@ -1,12 +1,18 @@
-import datetime
-from zoneinfo import ZoneInfo
-from google.adk.agents import Agent, LlmAgent, SequentialAgent
-from google.adk.models.lite_llm import LiteLlm
+import asyncio
+import functools
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
 from task_manager import AgentWithTaskManager
-from google.adk.runners import Runner
-from google.adk.artifacts import InMemoryArtifactService
-from google.adk.sessions import InMemorySessionService
-from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
+
+# ADK and LiteLLM are heavy to import, so they are only loaded when the agent
+# is built (see SQLAgent.warm_up) rather than when this module is imported.
+if TYPE_CHECKING:
+    from google.adk.agents import LlmAgent
+    from google.adk.runners import Runner
+    from google.adk.sessions import BaseSessionService
+    from pipeline import SpeculativeSQLPipelineAgent
+    from plan_cache import PlanCache
 
 
 def get_schema() -> str:
@@ -32,129 +38,226 @@ def get_schema() -> str:
     )"""
 
 
-# SQL schema analyzer -> SQL writer agent -> SQL refactor agent
-schema_analyzer_agent = LlmAgent(
-    name="sql_schema_analyzer",
-    model=LiteLlm(model="groq/meta-llama/llama-4-scout-17b-16e-instruct"),
-    description=(
-        "SQL schema analyzer agent that can analyse SQL schema based on human input by looking at the schema and the question."
-    ),
-    output_key='query_plan',
-    tools=[get_schema],
-    instruction=(
-        """
-        You are a SQL schema analyzer agent. You must use 'get_schema' tool to see database schema and analyze it with user's question. You will analyze the SQL schema and the question and return XML of field and query plan that potentially be used to answer the question.
-        For example: 
-        SQL schema:
-        CREATE TABLE `pets` (
-            `id` int(11) NOT NULL AUTO_INCREMENT,
-            `name` varchar(255) NOT NULL,
-            `breed` varchar(255) NOT NULL,
-            `age` int(11) NOT NULL,
-            `owner_id` int(11) NOT NULL,
-            PRIMARY KEY (`id`)
-        )
-        
-        **Question:**
-        What is the average age of pets with breed Labrador whose name contain 'ky'?
-        
-        **output:**
-        You will return XML of fields, tables, and query plan that potentially be used to answer the question.
-        For example:
-        <field>
-            <1>age</1>
-            <2>breed</2>
-            <3>name</3>
-        </field>
-        <table>
-            <1>pets</1>
-        </table>
-        <query_plan>
-            <1>Filter by breed Labrador</1>
-            <2>Filter by name contain 'ky'</2>
-            <3>Calculate average age</3>
-        </query_plan>
-        """
-    ),
+# The schema is constant, so it is rendered into the prompts once at import.
+SCHEMA_PROMPT = get_schema()
+
+# One terse few-shot example shared by every stage. Instructions put static
+# text (schema, example) first and per-request state last. That order is what
+# makes the prompt prefix identical across requests, so providers with
+# automatic prefix caching can reuse its prefill.
+EXAMPLE_TABLE = "pets(id, name, breed, age, owner_id)"
+EXAMPLE_QUESTION = "What is the average age of pets with breed Labrador whose name contain 'ky'?"
+EXAMPLE_PLAN = (
+    '{"fields": ["age", "breed", "name"], "tables": ["pets"], '
+    '"query_plan": ["Filter by breed Labrador", "Filter by name contain \'ky\'", "Calculate average age"]}'
 )
+EXAMPLE_SQL = "SELECT AVG(age) FROM pets WHERE breed = 'Labrador' AND name LIKE '%ky%'"
+
+ANALYZER_INSTRUCTION = f"""SQL schema:
+{SCHEMA_PROMPT}
+
+You are a SQL schema analyzer agent. Analyze the SQL schema above with user's question and return JSON of fields, tables, and query plan that potentially be used to answer the question.
+
+Example for table {EXAMPLE_TABLE}:
+Question: {EXAMPLE_QUESTION}
+Output: {EXAMPLE_PLAN}
+"""
+
+SPECULATIVE_WRITER_INSTRUCTION = f"""SQL schema:
+{SCHEMA_PROMPT}
+
+You are an SQL expert. Write the SQL query that answers user's question over the SQL schema above, using only the columns it needs. Return only the SQL query.
+
+Example for table {EXAMPLE_TABLE}:
+Question: {EXAMPLE_QUESTION}
+Output: {EXAMPLE_SQL}
+"""
+
+ONESHOT_INSTRUCTION = f"""SQL schema:
+{SCHEMA_PROMPT}
+
+You are an SQL expert. Write the final, efficient SQL query that answers user's question over the SQL schema above, selecting only the columns the answer needs. Return only the SQL query.
 
-sql_writer_agent = LlmAgent(
-    name="sql_writer",
-    model=LiteLlm(model="groq/meta-llama/llama-4-scout-17b-16e-instruct"),
-    description=(
-        "SQL writer agent"
-    ),
-    output_key='sql_output',
-    instruction=(
-        """ You are an SQL expert you will be given an XML that guide you what field and query plan to use together with user's question. You will write SQL query based on the XML and user's question.
-        For example:
-        XML of query plan:
-        <field>
-            <1>age</1>
-            <2>breed</2>
-            <3>name</3>
-        </field>
-        <query_plan>
-            <1>Filter by breed Labrador</1>
-            <2>Filter by name contain 'ky'</2>
-            <3>Calculate average age</3>
-        </query_plan>
-        
-        **User's question:**
-        What is the average age of pets with breed Labrador whose name contain 'ky'?
-        
-        **output:**
-        You will return SQL query that potentially be used to answer the question.
-        For example:
-        SELECT AVG(age) FROM pets WHERE breed = 'Labrador' AND name LIKE '%ky%'
-        
-        **XML of query plan**
-        {query_plan}
-        """ 
+Example for table {EXAMPLE_TABLE}:
+Question: {EXAMPLE_QUESTION}
+Output: {EXAMPLE_SQL}
+"""
+
+WRITER_INSTRUCTION = f"""You are an SQL expert. Write the SQL query that answers user's question following the JSON query plan of fields and steps below. Return only the SQL query.
+
+Example:
+Plan: {EXAMPLE_PLAN}
+Question: {EXAMPLE_QUESTION}
+Output: {EXAMPLE_SQL}
+
+**JSON of query plan**
+{{query_plan}}
+"""
+
+REFACTOR_INSTRUCTION = f"""You are an SQL expert. Refactor the SQL query below to make it more efficient for user's question, e.g. drop selected columns the JSON query plan does not need. Return only the SQL query.
+
+Example:
+Plan: {EXAMPLE_PLAN}
+Question: {EXAMPLE_QUESTION}
+SQL: SELECT AVG(age), name, breed FROM pets WHERE breed = 'Labrador' AND name LIKE '%ky%'
+Output: {EXAMPLE_SQL}
+
+**JSON of query plan**
+{{query_plan}}
+**SQL query:**
+{{sql_output}}
+"""
+
+# On models with structured outputs the analyzer's output is constrained to
+# this schema, so the plan is well-formed JSON that downstream stages can
+# parse directly. Other models fall back to JSON mode.
+QUERY_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "fields": {"type": "array", "items": {"type": "string"}},
+        "tables": {"type": "array", "items": {"type": "string"}},
+        "query_plan": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["fields", "tables", "query_plan"],
+    "additionalProperties": False,
+}
+
+
+@functools.cache
+def get_plan_cache() -> "PlanCache":
+    from plan_cache import PlanCache
+    return PlanCache(SCHEMA_PROMPT)
+
+
+# Simple questions: one-shot SQL agent
+# Otherwise: {SQL schema analyzer, speculative SQL writer} -> (SQL writer agent) -> SQL refactor agent
+@functools.cache
+def get_oneshot_agent() -> "LlmAgent":
+    from google.adk.agents import LlmAgent
+    from llm import get_writer_model, prompt_cache_key
+    return LlmAgent(
+        name="sql_oneshot",
+        model=get_writer_model(prompt_cache_key(ONESHOT_INSTRUCTION)),
+        description=(
+            "SQL agent that writes the final query for simple questions in a single call"
+        ),
+        output_key='refactored_sql_output',
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        instruction=ONESHOT_INSTRUCTION,
     )
-)
 
-sql_refactor_agent = LlmAgent(
-    name="sql_refactor",
-    model=LiteLlm(model="groq/meta-llama/llama-4-scout-17b-16e-instruct"),
-    description=(
-        "SQL refactor agent"
-    ),
-    output_key='refactored_sql_output',
-    instruction=(
-        """
-        You are an SQL expert. You will be given a SQL query, XML of query plan with related field, tables, and user's question that potentially be used to answer the question. You will refactor the SQL query to make it more efficient.
-        
-        For example:
-        **User's question:**
-        What is the average age of pets with breed Labrador whose name contain 'ky'?
-
-        **SQL query:**
-        SELECT AVG(age), name, breed FROM pets WHERE breed = 'Labrador' AND name LIKE '%ky%'
-        **XML of query plan**
-        <field>
-            <1>age</1>
-            <2>breed</2>
-            <3>name</3>
-        </field>
-        <query_plan>
-            <1>Filter by breed Labrador</1>
-            <2>Filter by name contain 'ky'</2>
-            <3>Calculate average age</3>
-        </query_plan>
-
-        **output:**
-        You will return SQL query that potentially be used to answer the question.
-        For example:
-        SELECT AVG(age) FROM pets WHERE breed = 'Labrador' AND name LIKE '%ky%'
-
-        **SQL query:**
-        {sql_output}
-        **XML of query plan**
-        {query_plan}
-        """
+
+@functools.cache
+def get_schema_analyzer_agent() -> "LlmAgent":
+    from google.adk.agents import LlmAgent
+    from llm import (
+        ANALYZER_MODEL,
+        ANALYZER_PRIORITY,
+        get_model,
+        prompt_cache_key,
+        supports_json_schema,
+    )
+    plan_cache = get_plan_cache()
+    if supports_json_schema(ANALYZER_MODEL):
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "query_plan",
+                "schema": QUERY_PLAN_SCHEMA,
+                "strict": True,
+            },
+        }
+    else:
+        # JSON mode only guarantees valid JSON; the instruction's example
+        # shows the expected fields.
+        response_format = {"type": "json_object"}
+    return LlmAgent(
+        name="sql_schema_analyzer",
+        model=get_model(
+            ANALYZER_MODEL,
+            ANALYZER_PRIORITY,
+            prompt_cache_key(ANALYZER_INSTRUCTION),
+            response_format=response_format,
+        ),
+        description=(
+            "SQL schema analyzer agent that can analyse SQL schema based on human input by looking at the schema and the question."
+        ),
+        output_key='query_plan',
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        before_model_callback=plan_cache.before_model_callback,
+        after_model_callback=plan_cache.after_model_callback,
+        instruction=ANALYZER_INSTRUCTION,
+    )
+
+
+@functools.cache
+def get_speculative_writer_agent() -> "LlmAgent":
+    from google.adk.agents import LlmAgent
+    from llm import get_writer_model, prompt_cache_key
+    return LlmAgent(
+        name="sql_speculative_writer",
+        model=get_writer_model(prompt_cache_key(SPECULATIVE_WRITER_INSTRUCTION)),
+        description=(
+            "SQL writer agent that drafts a query from the schema and question alone, without waiting for a query plan"
+        ),
+        output_key='sql_draft',
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        instruction=SPECULATIVE_WRITER_INSTRUCTION,
+    )
+
+
+@functools.cache
+def get_sql_writer_agent() -> "LlmAgent":
+    from google.adk.agents import LlmAgent
+    from llm import get_writer_model, prompt_cache_key
+    return LlmAgent(
+        name="sql_writer",
+        model=get_writer_model(prompt_cache_key(WRITER_INSTRUCTION)),
+        description=(
+            "SQL writer agent"
+        ),
+        output_key='sql_output',
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        instruction=WRITER_INSTRUCTION,
+    )
+
+
+@functools.cache
+def get_sql_refactor_agent() -> "LlmAgent":
+    from google.adk.agents import LlmAgent
+    from llm import REFACTOR_MODEL, REFACTOR_PRIORITY, get_model, prompt_cache_key
+    return LlmAgent(
+        name="sql_refactor",
+        model=get_model(
+            REFACTOR_MODEL, REFACTOR_PRIORITY, prompt_cache_key(REFACTOR_INSTRUCTION)
+        ),
+        description=(
+            "SQL refactor agent"
+        ),
+        output_key='refactored_sql_output',
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        instruction=REFACTOR_INSTRUCTION,
+    )
+
+
+@functools.cache
+def get_pipeline_agent() -> "SpeculativeSQLPipelineAgent":
+    """Builds the SQL pipeline once; ADK agents can only have one parent."""
+    from pipeline import SpeculativeSQLPipelineAgent
+    return SpeculativeSQLPipelineAgent(
+        name="SQLCodePipelineAgent",
+        oneshot_agent=get_oneshot_agent(),
+        analyzer_agent=get_schema_analyzer_agent(),
+        speculative_writer_agent=get_speculative_writer_agent(),
+        writer_agent=get_sql_writer_agent(),
+        refactor_agent=get_sql_refactor_agent(),
+        description="Writes simple queries in one call; otherwise executes SQL analysis and drafting in parallel, overlapped with writing if needed, then refactoring.",
     )
-)
 
 
 class SQLAgent(AgentWithTaskManager):
@@ -163,20 +266,59 @@ class SQLAgent(AgentWithTaskManager):
     SUPPORTED_CONTENT_TYPES = ["text", "text/plain"]
 
     def __init__(self):
-        self._agent = self._build_agent()
         self._user_id = "remote_agent"
-        self._runner = Runner(
-            app_name=self._agent.name,
-            agent=self._agent,
+        self._built_runner: Optional["Runner"] = None
+        self._build_lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        """Imports ADK and LiteLLM and builds the pipeline ahead of the first request.
+
+        Meant to run in a background thread while the server starts. Building
+        on the first request would run the imports inside the server's event
+        loop and stall every open connection; a request that arrives before
+        the warm-up is done still waits for it, see ready().
+        """
+        self._runner
+
+    async def ready(self) -> None:
+        """Waits for warm_up() in a worker thread, keeping the event loop free."""
+        if self._built_runner is None:
+            await asyncio.to_thread(self.warm_up)
+
+    @property
+    def _agent(self) -> "SpeculativeSQLPipelineAgent":
+        return self._runner.agent
+
+    @property
+    def _runner(self) -> "Runner":
+        """Builds the runner once, whether from warm_up() or the first request."""
+        with self._build_lock:
+            if self._built_runner is None:
+                self._built_runner = self._build_runner()
+            return self._built_runner
+
+    def _build_runner(self) -> "Runner":
+        from google.adk.artifacts import InMemoryArtifactService
+        from google.adk.memory.in_memory_memory_service import InMemoryMemoryService
+        from google.adk.runners import Runner
+        agent = self._build_agent()
+        return Runner(
+            app_name=agent.name,
+            agent=agent,
             artifact_service=InMemoryArtifactService(),
-            session_service=InMemorySessionService(),
+            session_service=self._build_session_service(),
             memory_service=InMemoryMemoryService(),
         )
     
-    def _build_agent(self) -> SequentialAgent:
+    def _build_session_service(self) -> "BaseSessionService":
+        """Uses Redis when REDIS_URL is set so sessions are shared across processes."""
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            from google.adk.sessions import InMemorySessionService
+            return InMemorySessionService()
+        from redis_session_service import RedisSessionService
+        return RedisSessionService.from_url(redis_url)
+
+    def _build_agent(self) -> "SpeculativeSQLPipelineAgent":
         """Builds the LLM agent for writing SQL query."""
-        return SequentialAgent(
-            name="SQLCodePipelineAgent",
-            sub_agents=[schema_analyzer_agent, sql_writer_agent, sql_refactor_agent],
-            description="Executes a sequence of SQL analyzer, reviewing, and refactoring.",
-        )
+        return get_pipeline_agent()
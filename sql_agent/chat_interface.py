@@ -1,105 +1,228 @@
 import streamlit as st
-import requests
-import json
+import asyncio
+import hashlib
+import threading
+import httpx
+import orjson
 import uuid
-import sseclient
 import time
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
+
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns the background event loop shared by every chat session.
+
+    Streamlit runs each session's script on its own thread; driving all
+    requests from one long-lived loop keeps a slow response in one tab from
+    blocking the others.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
 
 # A2A Client for interacting with the SQL Agent
 class A2AClient:
+    # Completed responses kept for repeated prompts, across all sessions.
+    CACHE_SIZE = 256
+
     def __init__(self, server_url: str):
         self.server_url = server_url
-        self.session_id = str(uuid.uuid4())
+        # One pooled HTTP client, shared by every chat session using this
+        # server, so follow-up messages reuse warm connections.
+        self._http = httpx.AsyncClient(
+            http2=True,
+            timeout=None,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+        # Request fields that never change.
+        self._params_template = {"acceptedOutputModes": ["text"]}
+        # Responses to prompts already answered in a session, most recently
+        # used last. Sessions run on their own threads, hence the lock.
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+    @staticmethod
+    def new_session_id() -> str:
+        """Return a fresh A2A session id for a chat."""
+        return uuid.uuid4().hex
+        
+    def clear_session(self, session_id: str) -> None:
+        """Drop every cached response for ``session_id``, e.g. on a new chat."""
+        with self._cache_lock:
+            for key in [key for key in self._cache if key[0] == session_id]:
+                del self._cache[key]
+        
+    @staticmethod
+    def _cache_key(session_id: str, message: str, stream: bool) -> tuple:
+        # Streaming and plain responses have different shapes.
+        return (session_id, stream, hashlib.blake2b(message.encode()).digest())
+        
+    def _cache_get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            response = self._cache.get(key)
+            if response is not None:
+                self._cache.move_to_end(key)
+            return response
         
-    def send_message(self, message: str, stream: bool = True) -> Dict[str, Any]:
-        """Send a message to the A2A server and get the response."""
-        task_id = str(uuid.uuid4())
+    def _cache_put(self, key: tuple, response: Dict[str, Any]) -> None:
+        # Only complete answers are worth replaying; errors should be retried.
+        if "error" in response or response.get("status", "complete") != "complete":
+            return
+        with self._cache_lock:
+            self._cache[key] = response
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
         
+    def _build_payload(self, method: str, task_id: str, session_id: str, message: str) -> bytes:
+        """Serialize a JSON-RPC request for ``message`` from the request template."""
+        params = dict(self._params_template)
+        params["id"] = task_id
+        params["sessionId"] = session_id
+        params["message"] = {"role": "user", "parts": [{"type": "text", "text": message}]}
+        return orjson.dumps({"jsonrpc": "2.0", "id": task_id, "method": method, "params": params})
+        
+    def send_message(self, message: str, session_id: str, stream: bool = True) -> Dict[str, Any]:
+        """Send a message to the A2A server and get the response.
+
+        A prompt already answered in this session is served from the cache.
+        """
+        key = self._cache_key(session_id, message, stream)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        task_id = uuid.uuid4().hex
         if stream:
-            return self._send_streaming_request(task_id, message)
+            coro = self._send_streaming_request(task_id, session_id, message)
         else:
-            return self._send_request(task_id, message)
+            coro = self._send_request(task_id, session_id, message)
+        response = asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+        self._cache_put(key, response)
+        return response
     
-    def _send_request(self, task_id: str, message: str) -> Dict[str, Any]:
+    async def _send_request(self, task_id: str, session_id: str, message: str) -> Dict[str, Any]:
         """Send a non-streaming request to the A2A server."""
-        payload = {
-            "jsonrpc": "2.0",
-            "id": task_id,
-            "method": "tasks/send",
-            "params": {
-                "id": task_id,
-                "sessionId": self.session_id,
-                "message": {
-                    "role": "user",
-                    "parts": [{"type": "text", "text": message}]
-                },
-                "acceptedOutputModes": ["text"]
-            }
-        }
+        payload = self._build_payload("tasks/send", task_id, session_id, message)
+        headers = {'Content-Type': 'application/json'}
         
-        response = requests.post(self.server_url, json=payload)
+        response = await self._http.post(self.server_url, content=payload, headers=headers)
         if response.status_code != 200:
             return {"error": f"Error: {response.status_code} - {response.text}"}
         
         return response.json()
     
-    def _send_streaming_request(self, task_id: str, message: str) -> Dict[str, Any]:
+    def stream_message(self, message: str, session_id: str) -> Iterator[Dict[str, Any]]:
+        """Send a message and yield pipeline stage updates as they arrive.
+
+        Stage updates carry the sub-agent ``author`` and its output; the last
+        item is the final response, as returned by ``send_message``. A prompt
+        already answered in this session yields only its cached response.
+        """
+        key = self._cache_key(session_id, message, True)
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        loop = get_event_loop()
+        updates = self._stream_updates(uuid.uuid4().hex, session_id, message)
+        try:
+            while True:
+                try:
+                    update = asyncio.run_coroutine_threadsafe(updates.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+                if update.get("status") != "working":
+                    self._cache_put(key, update)
+                yield update
+        finally:
+            asyncio.run_coroutine_threadsafe(updates.aclose(), loop).result()
+    
+    async def _send_streaming_request(self, task_id: str, session_id: str, message: str) -> Dict[str, Any]:
         """Send a streaming request to the A2A server and process SSE responses."""
-        payload = {
-            "jsonrpc": "2.0",
-            "id": task_id,
-            "method": "tasks/sendSubscribe",
-            "params": {
-                "id": task_id,
-                "sessionId": self.session_id,
-                "message": {
-                    "role": "user",
-                    "parts": [{"type": "text", "text": message}]
-                },
-                "acceptedOutputModes": ["text"]
-            }
-        }
+        final_response = {}
+        async for update in self._stream_updates(task_id, session_id, message):
+            final_response = update
+        return final_response
+    
+    async def _stream_updates(self, task_id: str, session_id: str, message: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield stage updates from the SSE stream, then the final response."""
+        payload = self._build_payload("tasks/sendSubscribe", task_id, session_id, message)
         
         headers = {'Accept': 'text/event-stream', 'Content-Type': 'application/json'}
-        response = requests.post(self.server_url, json=payload, headers=headers, stream=True)
-        
-        if response.status_code != 200:
-            return {"error": f"Error: {response.status_code} - {response.text}"}
-        
-        client = sseclient.SSEClient(response)
-        
-        # Process the SSE events
-        final_response = {"status": "incomplete", "content": ""}
-        for event in client.events():
-            if not event.data:
-                continue
-                
-            data = json.loads(event.data)
-            if "result" in data:
-                result = data["result"]
-                
-                # Handle task status update
-                if "status" in result:
-                    status = result["status"]
-                    if "message" in status and status["message"]:
-                        message_parts = status["message"]["parts"]
-                        for part in message_parts:
-                            if part["type"] == "text":
-                                final_response["content"] = part["text"]
-                
-                # Check if this is the final message
-                if "final" in result and result["final"]:
-                    final_response["status"] = "complete"
-                    break
+        async with self._http.stream("POST", self.server_url, content=payload, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                yield {"error": f"Error: {response.status_code} - {response.text}"}
+                return
             
-            # Handle errors
-            if "error" in data:
-                final_response["status"] = "error"
-                final_response["error"] = data["error"]
-                break
+            # Process the SSE events
+            final_response = {"status": "incomplete", "content": ""}
+            async for data in self._iter_sse_data(response):
+                if "result" in data:
+                    result = data["result"]
+                    
+                    # Handle task status update
+                    if "status" in result:
+                        status = result["status"]
+                        if "message" in status and status["message"]:
+                            message_parts = status["message"]["parts"]
+                            for part in message_parts:
+                                if part["type"] != "text":
+                                    continue
+                                author = (part.get("metadata") or {}).get("author")
+                                if author:
+                                    yield {"status": "working", "author": author, "content": part["text"]}
+                                elif status["state"] != "working":
+                                    final_response["content"] = part["text"]
+                    
+                    # Check if this is the final message
+                    if "final" in result and result["final"]:
+                        final_response["status"] = "complete"
+                        break
                 
-        return final_response
+                # Handle errors
+                if "error" in data:
+                    final_response["status"] = "error"
+                    final_response["error"] = data["error"]
+                    break
+                    
+            yield final_response
+
+    @staticmethod
+    async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the decoded JSON payload of each SSE event in the response."""
+        buf = b""
+        async for chunk in response.aiter_bytes():
+            # sse-starlette separates lines with CRLF; normalize so events
+            # always end in a blank line of b"\n\n".
+            buf = (buf + chunk).replace(b"\r\n", b"\n")
+            *events, buf = buf.split(b"\n\n")
+            for event in events:
+                data = [
+                    line[5:].removeprefix(b" ")
+                    for line in event.split(b"\n")
+                    if line.startswith(b"data:")
+                ]
+                if data:
+                    yield orjson.loads(b"\n".join(data))
+
+@st.cache_resource
+def get_client(server_url: str) -> A2AClient:
+    """Return the A2A client for ``server_url``, shared across all sessions."""
+    return A2AClient(server_url)
+
+# Intermediate pipeline stages shown as expanders, with the language used to
+# render their output. Any other stage streams into the main message.
+STAGES = {
+    "sql_schema_analyzer": ("Query plan", "json"),
+    "sql_speculative_writer": ("SQL draft", "sql"),
+    "sql_writer": ("SQL query", "sql"),
+}
 
 # Streamlit UI
 def main():
@@ -109,10 +232,19 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
     
-    if "client" not in st.session_state:
-        # Default to localhost:10002 as seen in the __main__.py file
-        server_url = st.sidebar.text_input("Server URL", "http://localhost:10002/")
-        st.session_state.client = A2AClient(server_url)
+    # Default to localhost:10002 as seen in the __main__.py file
+    server_url = st.sidebar.text_input("Server URL", "http://localhost:10002/")
+    client = get_client(server_url)
+    
+    # Each browser tab keeps its own A2A session on the shared client
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = A2AClient.new_session_id()
+    
+    # A new chat starts a fresh A2A session and forgets the old one's answers
+    if st.sidebar.button("New chat"):
+        client.clear_session(st.session_state.session_id)
+        st.session_state.session_id = A2AClient.new_session_id()
+        st.session_state.messages = []
     
     # Display chat messages
     for message in st.session_state.messages:
@@ -133,8 +265,21 @@ def main():
             message_placeholder = st.empty()
             message_placeholder.text("Thinking...")
             
+            stage_placeholders = {}
+            
             try:
-                response = st.session_state.client.send_message(prompt)
+                response = {}
+                for update in client.stream_message(prompt, st.session_state.session_id):
+                    if update.get("status") != "working":
+                        response = update
+                    elif update["author"] in STAGES:
+                        label, language = STAGES[update["author"]]
+                        if label not in stage_placeholders:
+                            with st.expander(label):
+                                stage_placeholders[label] = st.empty()
+                        stage_placeholders[label].code(update["content"], language=language)
+                    else:
+                        message_placeholder.write(update["content"])
                 
                 if "error" in response:
                     message_placeholder.error(f"Error: {response['error']}")
@@ -0,0 +1,391 @@
+"""Shared LiteLLM models and HTTP plumbing for the SQL agent pipeline."""
+
+import asyncio
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
+import os
+import threading
+from typing import AsyncGenerator, Optional
+
+import httpx
+import litellm
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.models.lite_llm import LiteLlm
+from pydantic import PrivateAttr
+
+DEFAULT_MODEL = "groq/meta-llama/llama-4-scout-17b-16e-instruct"
+
+SMALL_MODEL = "groq/llama-3.1-8b-instant"
+
+# Each pipeline stage can be routed to its own model. Only plan analysis needs
+# the larger model: writing SQL from a structured plan and refactoring a short
+# SQL string are narrow tasks a small, fast model handles well. An analyzer
+# model without JSON schema support (see supports_json_schema) gets plain
+# JSON mode instead of a schema-constrained plan.
+ANALYZER_MODEL = os.getenv("SQL_ANALYZER_MODEL", DEFAULT_MODEL)
+WRITER_MODEL = os.getenv("SQL_WRITER_MODEL", SMALL_MODEL)
+REFACTOR_MODEL = os.getenv("SQL_REFACTOR_MODEL", SMALL_MODEL)
+
+# The writer can also be served from a self-hosted OpenAI-compatible endpoint,
+# e.g. a quantized model on vLLM: SQL_WRITER_MODEL=openai/<served-model-name>
+# with SQL_WRITER_API_BASE=http://host:8000/v1.
+WRITER_API_BASE = os.getenv("SQL_WRITER_API_BASE")
+
+# With REDUNDANT=1 every writer call is sent to two replicas at once and the
+# slower one is cancelled. The second replica can point at another model or
+# deployment so their tail latencies are independent.
+REDUNDANT = os.getenv("REDUNDANT") == "1"
+REDUNDANT_WRITER_MODEL = os.getenv("SQL_WRITER_REDUNDANT_MODEL", WRITER_MODEL)
+REDUNDANT_WRITER_API_BASE = os.getenv("SQL_WRITER_REDUNDANT_API_BASE", WRITER_API_BASE)
+
+# Prefix caching comes from the prompt layout: every stage puts its static
+# instruction first, so requests share a prefix that providers with automatic
+# prefix caching can reuse without any extra request fields. With
+# SQL_AGENT_PROMPT_CACHE_HEADERS=1 each stage's prefix hash is also sent as an
+# x-cache-key header, for a proxy or self-hosted endpoint configured to key a
+# cache on it. It is off by default.
+PROMPT_CACHE_HEADERS = os.getenv("SQL_AGENT_PROMPT_CACHE_HEADERS") == "1"
+
+# Models known to accept a json_schema response_format that LiteLLM's model
+# map does not list as such. They are registered with LiteLLM, whose Groq
+# adapter would otherwise rewrite the schema into a forced json_tool_call.
+JSON_SCHEMA_MODELS = frozenset({DEFAULT_MODEL})
+litellm.register_model(
+    {
+        model: {
+            "litellm_provider": model.split("/", 1)[0],
+            "mode": "chat",
+            "supports_response_schema": True,
+        }
+        for model in JSON_SCHEMA_MODELS
+    }
+)
+
+# Provider calls can be capped per process with SQL_AGENT_MAX_CONCURRENT_CALLS,
+# e.g. to stay under a provider's concurrency limit. Slots are handed out by
+# stage priority (lower goes first), so later stages win and in-flight
+# questions finish before new ones start their analysis. There is no cap by
+# default, since any cap is also a ceiling on throughput.
+_max_calls = os.getenv("SQL_AGENT_MAX_CONCURRENT_CALLS")
+MAX_CONCURRENT_CALLS = int(_max_calls) if _max_calls else None
+ANALYZER_PRIORITY = 2
+WRITER_PRIORITY = 1
+REFACTOR_PRIORITY = 0
+
+
+class _PerLoopTransport(httpx.AsyncBaseTransport):
+    """Keeps a separate connection pool for each event loop.
+
+    Pooled connections belong to the loop that opened them, and agents run on
+    more than one loop: the server's, plus a new one per synchronous
+    Runner.run.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._transports: dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+        self._lock = threading.Lock()
+
+    def _get_transport(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                # Connections of a closed loop can be neither reused nor
+                # closed cleanly, so just let them go.
+                for closed in [other for other in self._transports if other.is_closed()]:
+                    del self._transports[closed]
+                transport = self._transports[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._get_transport().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+# Keep-alive HTTP/2 connection pools for stages served from a self-hosted
+# OpenAI-compatible endpoint (openai/... models, see SQL_WRITER_API_BASE).
+# LiteLLM only hands client_session and aclient_session to the OpenAI SDK.
+# Groq models go through LiteLLM's own HTTP handler, which already keeps one
+# pooled client per provider and event loop, so the pools are only set up
+# when some stage uses an openai/ model.
+USES_OPENAI_COMPATIBLE_ENDPOINT = any(
+    model.startswith("openai/")
+    for model in (ANALYZER_MODEL, WRITER_MODEL, REFACTOR_MODEL, REDUNDANT_WRITER_MODEL)
+)
+if USES_OPENAI_COMPATIBLE_ENDPOINT:
+    _limits = httpx.Limits(max_keepalive_connections=64)
+    litellm.client_session = httpx.Client(http2=True, limits=_limits)
+    litellm.aclient_session = httpx.AsyncClient(
+        transport=_PerLoopTransport(http2=True, limits=_limits)
+    )
+
+
+async def _collect(llm: BaseLlm, llm_request: LlmRequest) -> list[LlmResponse]:
+    # Models may mutate the request, so each call gets its own copy.
+    request = llm_request.model_copy(deep=True)
+    return [response async for response in llm.generate_content_async(request)]
+
+
+class PriorityScheduler:
+    """Limits concurrent provider calls and grants them by priority.
+
+    Waiters are served by (priority, arrival order), so under contention a
+    lower priority value always runs before a higher one. One scheduler is
+    shared by every thread and event loop in the process; a freed slot is
+    handed to its waiter on the waiter's own loop.
+    """
+
+    def __init__(self, limit: int):
+        self._available = limit
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int) -> None:
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            waiter = (priority, next(self._counter), future)
+            heapq.heappush(self._waiters, waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # The slot was granted just before we were cancelled.
+                self._release()
+            else:
+                with self._lock:
+                    if waiter in self._waiters:
+                        # Don't keep the future, and with it its loop, alive.
+                        self._waiters.remove(waiter)
+                        heapq.heapify(self._waiters)
+                # Otherwise the slot is already on its way, and _grant passes
+                # it on.
+            raise
+
+    def _release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._available += 1
+                return
+            _, _, future = heapq.heappop(self._waiters)
+        try:
+            future.get_loop().call_soon_threadsafe(self._grant, future)
+        except RuntimeError:
+            # The waiter's loop has closed.
+            self._release()
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            # The waiter was cancelled before the slot reached it.
+            self._release()
+        else:
+            future.set_result(None)
+
+
+_scheduler = PriorityScheduler(MAX_CONCURRENT_CALLS) if MAX_CONCURRENT_CALLS else None
+
+
+def _slot(priority: int) -> contextlib.AbstractAsyncContextManager:
+    if _scheduler is None:
+        return contextlib.nullcontext()
+    return _scheduler.slot(priority)
+
+
+class ScheduledLlm(BaseLlm):
+    """Holds a provider slot at `priority` for each call to `inner`."""
+
+    inner: BaseLlm
+    priority: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        async with _slot(self.priority):
+            responses = [
+                response async for response in self.inner.generate_content_async(llm_request)
+            ]
+        for response in responses:
+            yield response
+
+
+class HedgedLlm(BaseLlm):
+    """Sends each request to all replicas concurrently and keeps the first answer.
+
+    The remaining calls are cancelled as soon as one replica succeeds. Calls
+    are always made without streaming so a winner can be picked as a whole.
+    """
+
+    replicas: list[BaseLlm]
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        pending = {
+            asyncio.create_task(_collect(replica, llm_request))
+            for replica in self.replicas
+        }
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        for response in task.result():
+                            yield response
+                        return
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+
+class _SharedCall:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class CoalescingLlm(BaseLlm):
+    """Merges identical in-flight requests into one call to `inner`.
+
+    A request that matches one already in flight on the same event loop, such
+    as several users asking the same question, waits for that call instead of
+    making its own. Other requests are sent to `inner` straight away. The
+    shared call is cancelled
+    once every caller waiting on it has been cancelled, e.g. when the
+    pipeline drops a writer whose answer is no longer needed.
+    """
+
+    inner: BaseLlm
+
+    # In-flight calls by event loop and request. ADK's synchronous runner
+    # drives agents on a loop of its own, and a task belongs to its loop.
+    _calls: dict = PrivateAttr(default_factory=dict)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        key = (
+            asyncio.get_running_loop(),
+            llm_request.model_dump_json(include={"model", "contents", "config"}),
+        )
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _SharedCall(
+                asyncio.create_task(self._call(llm_request))
+            )
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        call.waiters += 1
+        try:
+            responses = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
+        for response in responses:
+            yield response
+
+    def _forget(self, key: tuple, call: _SharedCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def _call(self, llm_request: LlmRequest) -> list[LlmResponse]:
+        return await _collect(self.inner, llm_request)
+
+
+def supports_json_schema(model: str) -> bool:
+    """Returns whether `model` accepts a json_schema response_format."""
+    return litellm.supports_response_schema(model=model)
+
+
+def prompt_cache_key(prompt: str) -> str:
+    """Returns a stable key for a static prompt prefix."""
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def _lite_llm(
+    model: str,
+    cache_key: Optional[str] = None,
+    api_base: Optional[str] = None,
+    response_format: Optional[dict] = None,
+) -> LiteLlm:
+    kwargs = {}
+    if cache_key is not None and PROMPT_CACHE_HEADERS:
+        kwargs["extra_headers"] = {"x-cache-key": cache_key}
+    if api_base is not None:
+        kwargs["api_base"] = api_base
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return LiteLlm(model=model, **kwargs)
+
+
+def get_model(
+    model: str = DEFAULT_MODEL,
+    priority: int = 0,
+    cache_key: Optional[str] = None,
+    api_base: Optional[str] = None,
+    response_format: Optional[dict] = None,
+) -> BaseLlm:
+    """Returns the coalesced `model` scheduled at `priority`.
+
+    `response_format` is passed through to the provider, e.g. a JSON schema
+    to constrain the output. Callers build one model per stage and reuse it,
+    so identical concurrent requests of that stage share one call.
+    """
+    return CoalescingLlm(
+        model=model,
+        inner=ScheduledLlm(
+            model=model,
+            inner=_lite_llm(model, cache_key, api_base, response_format),
+            priority=priority,
+        ),
+    )
+
+
+@functools.cache
+def get_writer_model(cache_key: Optional[str] = None) -> BaseLlm:
+    """Returns the model for the SQL writer stages, hedged when REDUNDANT=1."""
+    if not REDUNDANT:
+        return get_model(WRITER_MODEL, WRITER_PRIORITY, cache_key, WRITER_API_BASE)
+    # Replicas bypass coalescing so the two hedged calls are never merged,
+    # and each holds its own provider slot.
+    replicas = [
+        (WRITER_MODEL, WRITER_API_BASE),
+        (REDUNDANT_WRITER_MODEL, REDUNDANT_WRITER_API_BASE),
+    ]
+    hedged = HedgedLlm(
+        model=WRITER_MODEL,
+        replicas=[
+            ScheduledLlm(
+                model=model,
+                inner=_lite_llm(model, cache_key, api_base),
+                priority=WRITER_PRIORITY,
+            )
+            for model, api_base in replicas
+        ],
+    )
+    return CoalescingLlm(model=WRITER_MODEL, inner=hedged)
@@ -0,0 +1,202 @@
+"""SQL pipeline agent that speculatively drafts SQL alongside schema analysis."""
+
+import asyncio
+import json
+import re
+from typing import AsyncGenerator
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+from utils import user_question
+
+
+def _plan_names(query_plan: str) -> tuple[list[str], list[str]]:
+    """Returns the planned fields and tables, or empty lists for a malformed plan."""
+    try:
+        plan = json.loads(query_plan)
+        return list(plan["fields"]), list(plan["tables"])
+    except (ValueError, TypeError, KeyError):
+        return [], []
+
+
+def draft_matches_plan(draft: str, query_plan: str) -> bool:
+    """Checks whether a speculative SQL draft covers the analyzer's plan.
+
+    The draft is accepted when every planned field and table appears in it;
+    anything else is treated as a material disagreement.
+    """
+    fields, tables = _plan_names(query_plan)
+    if not draft or not fields:
+        return False
+    return all(
+        re.search(rf"\b{re.escape(name)}\b", draft, re.IGNORECASE)
+        for name in fields + tables
+    )
+
+
+# Wording that usually needs more than a filter and an aggregate: joins,
+# grouping ("by <column>", "for each", "every"), ranking, comparisons and
+# nested queries. "sorted by" and "ordered by" only add an ORDER BY.
+_COMPLEX_QUESTION = re.compile(
+    r"\b(join|joined|each|every|per|group|grouped|(?<!sorted )(?<!ordered )by|rank|"
+    r"ranked|top|bottom|highest|lowest|most|least|compare|compared|versus|vs|ratio|"
+    r"percent|percentage|share|trend|over time|running|cumulative|than (the )?average|"
+    r"duplicate|distinct|both|either|neither|except|unless|without any)\b",
+    re.IGNORECASE,
+)
+_MAX_SIMPLE_QUESTION_WORDS = 25
+
+
+def is_complex_question(question: str) -> bool:
+    """Cheap rule-based check for questions that need the full pipeline."""
+    return (
+        len(question.split()) > _MAX_SIMPLE_QUESTION_WORDS
+        or _COMPLEX_QUESTION.search(question) is not None
+    )
+
+
+class SpeculativeSQLPipelineAgent(BaseAgent):
+    """Runs the schema analyzer and a speculative SQL writer concurrently.
+
+    The plan-guided writer starts as soon as the analyzer's plan is ready,
+    overlapping with a speculative draft that is still being written. A draft
+    that agrees with the plan is handed straight to the refactor agent and
+    cancels the writer; otherwise the writer's query is used, and the draft is
+    cancelled as soon as the writer is done. A plan served from the plan
+    cache arrives almost at once, so then the writer only starts if the
+    finished draft disagrees with it.
+
+    Simple questions skip all of this and go to `oneshot_agent`, which writes
+    the final query in a single call.
+    """
+
+    oneshot_agent: LlmAgent
+    analyzer_agent: LlmAgent
+    speculative_writer_agent: LlmAgent
+    writer_agent: LlmAgent
+    refactor_agent: LlmAgent
+
+    def __init__(
+        self,
+        name: str,
+        oneshot_agent: LlmAgent,
+        analyzer_agent: LlmAgent,
+        speculative_writer_agent: LlmAgent,
+        writer_agent: LlmAgent,
+        refactor_agent: LlmAgent,
+        **kwargs,
+    ):
+        super().__init__(
+            name=name,
+            oneshot_agent=oneshot_agent,
+            analyzer_agent=analyzer_agent,
+            speculative_writer_agent=speculative_writer_agent,
+            writer_agent=writer_agent,
+            refactor_agent=refactor_agent,
+            sub_agents=[
+                oneshot_agent,
+                analyzer_agent,
+                speculative_writer_agent,
+                writer_agent,
+                refactor_agent,
+            ],
+            **kwargs,
+        )
+
+    def _accept_draft(self, ctx: InvocationContext, draft: str) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={"sql_output": draft}),
+        )
+
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        if not is_complex_question(user_question(ctx)):
+            async for event in self.oneshot_agent.run_async(ctx):
+                yield event
+            return
+
+        # The analyzer, the speculative writer and the writer each get their
+        # own branch so none sees the others' events, as under a ParallelAgent.
+        # In particular the writer must not be shown the rejected draft.
+        base = f"{ctx.branch}.{self.name}" if ctx.branch else self.name
+
+        def branch_ctx(agent: LlmAgent) -> InvocationContext:
+            return ctx.model_copy(update={"branch": f"{base}.{agent.name}"})
+
+        runs = {
+            "plan": self.analyzer_agent.run_async(branch_ctx(self.analyzer_agent)),
+            "draft": self.speculative_writer_agent.run_async(
+                branch_ctx(self.speculative_writer_agent)
+            ),
+        }
+        tasks = {key: asyncio.create_task(run.__anext__()) for key, run in runs.items()}
+        finished = set()
+
+        def start_writer():
+            runs["writer"] = self.writer_agent.run_async(branch_ctx(self.writer_agent))
+            tasks["writer"] = asyncio.create_task(runs["writer"].__anext__())
+
+        async def stop(key: str):
+            task = tasks.pop(key)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await runs.pop(key).aclose()
+
+        def draft_accepted() -> bool:
+            return draft_matches_plan(
+                ctx.session.state.get("sql_draft", ""),
+                ctx.session.state.get("query_plan", ""),
+            )
+
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks.values(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for key in [key for key, task in tasks.items() if task in done]:
+                    if key not in tasks:
+                        # Stopped earlier in this round.
+                        continue
+                    try:
+                        event = tasks.pop(key).result()
+                    except StopAsyncIteration:
+                        finished.add(key)
+                    else:
+                        # Only move a run on once the runner has processed
+                        # its previous event, so session state is current.
+                        yield event
+                        tasks[key] = asyncio.create_task(runs[key].__anext__())
+                        continue
+
+                    if key == "plan":
+                        if "draft" in finished:
+                            if draft_accepted():
+                                yield self._accept_draft(ctx, ctx.session.state["sql_draft"])
+                            else:
+                                start_writer()
+                        elif not ctx.session.state.get("query_plan_cached"):
+                            start_writer()
+                    elif key == "draft" and "plan" in finished:
+                        if draft_accepted():
+                            if "writer" in tasks:
+                                await stop("writer")
+                            yield self._accept_draft(ctx, ctx.session.state["sql_draft"])
+                        elif "writer" not in runs:
+                            start_writer()
+                    elif key == "writer" and "draft" in tasks:
+                        await stop("draft")
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for run in runs.values():
+                await run.aclose()
+
+        async for event in self.refactor_agent.run_async(ctx):
+            yield event
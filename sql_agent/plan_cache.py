@@ -0,0 +1,152 @@
+"""Semantic cache for the schema analyzer's query plans."""
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from cachetools import TTLCache
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+from utils import user_question
+
+_WORD = re.compile(r"[a-z0-9_]+")
+_TOKEN = re.compile(r"'[^']*'|\"[^\"]*\"|[A-Za-z0-9_]+")
+
+# Negations, comparisons and connectives: questions that differ in any of
+# these need a different plan, however similar the rest of the wording.
+_KEY_WORDS = frozenset(
+    """
+    not no non none never without except excluding exclude neither nor unless
+    and or more less fewer greater higher lower larger smaller over under above
+    below before after since until between than least most max min maximum
+    minimum top bottom first last earliest latest highest lowest largest
+    smallest equal exactly only ascending descending asc desc
+    """.split()
+)
+
+
+def _normalize(question: str) -> str:
+    return " ".join(_WORD.findall(question.lower()))
+
+
+def _vector(normalized: str) -> Counter:
+    # Word pairs make the comparison order-aware.
+    words = normalized.split()
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[word] for word, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _key_terms(question: str) -> tuple[str, ...]:
+    """Returns the terms a near-duplicate must repeat exactly and in order.
+
+    These are key words, numbers, quoted values and capitalized names (other
+    than the first word), any of which changes the plan when it differs.
+    """
+    terms = []
+    for i, match in enumerate(_TOKEN.finditer(question)):
+        token = match.group()
+        if (
+            token[0] in "'\""
+            or token.lower() in _KEY_WORDS
+            or any(c.isdigit() for c in token)
+            or (i > 0 and token[0].isupper())
+        ):
+            terms.append(token.lower())
+    return tuple(terms)
+
+
+def _has_history(callback_context: CallbackContext) -> bool:
+    # A follow-up's plan depends on earlier turns, not just its own wording.
+    ctx = callback_context._invocation_context
+    return any(event.invocation_id != ctx.invocation_id for event in ctx.session.events)
+
+
+class PlanCache:
+    """Caches query plans by (schema hash, question) with near-duplicate matching.
+
+    Questions are compared as vectors of words and word pairs, so rephrasings
+    that only differ in case, punctuation or a filler word reuse the cached
+    plan, as long as their key terms (see `_key_terms`) match in order. Only
+    the first question of a session is cached or served from the cache. Used
+    as the analyzer's model callbacks, a hit skips the LLM call entirely.
+    """
+
+    def __init__(
+        self,
+        schema: str,
+        maxsize: int = 4096,
+        ttl: int = 3600,
+        threshold: float = 0.95,
+    ):
+        self.schema_hash = hashlib.sha256(schema.encode()).hexdigest()
+        self.threshold = threshold
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def lookup(self, question: str) -> Optional[str]:
+        """Returns the cached plan for `question` or a near-duplicate of it."""
+        normalized = _normalize(question)
+        with self._lock:
+            entry = self._cache.get((self.schema_hash, normalized))
+            if entry is not None:
+                return entry[2]
+            vector = _vector(normalized)
+            terms = _key_terms(question)
+            for (schema_hash, _), (cached_vector, cached_terms, plan) in list(
+                self._cache.items()
+            ):
+                if (
+                    schema_hash == self.schema_hash
+                    and cached_terms == terms
+                    and _cosine(vector, cached_vector) >= self.threshold
+                ):
+                    return plan
+        return None
+
+    def store(self, question: str, plan: str) -> None:
+        normalized = _normalize(question)
+        with self._lock:
+            self._cache[(self.schema_hash, normalized)] = (
+                _vector(normalized),
+                _key_terms(question),
+                plan,
+            )
+
+    def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        question = user_question(callback_context)
+        plan = None
+        if question and not _has_history(callback_context):
+            plan = self.lookup(question)
+        # Tells the pipeline whether this plan arrives without an LLM call.
+        callback_context.state["query_plan_cached"] = plan is not None
+        if plan is None:
+            return None
+        return LlmResponse(
+            content=types.Content(role="model", parts=[types.Part.from_text(text=plan)])
+        )
+
+    def after_model_callback(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        content = llm_response.content
+        if llm_response.partial or not content or not content.parts:
+            return None
+        if any(part.function_call for part in content.parts):
+            return None
+        plan = "".join(part.text for part in content.parts if part.text)
+        question = user_question(callback_context)
+        if plan and question and not _has_history(callback_context):
+            self.store(question, plan)
+        return None
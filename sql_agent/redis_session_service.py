@@ -0,0 +1,169 @@
+"""Redis-backed ADK session service."""
+
+import json
+import time
+import uuid
+from typing import Any, Optional
+
+import redis
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListEventsResponse,
+    ListSessionsResponse,
+)
+
+
+class RedisSessionService(BaseSessionService):
+    """Stores ADK sessions in Redis so they are shared by every agent process.
+
+    A session's events are kept in a list and its state in a hash, so
+    appending an event pushes just that event and sets just the state keys it
+    changes. A per-user sorted set indexes the session ids by last update
+    time. Everything expires `ttl` seconds after the session's last update.
+    Unlike InMemorySessionService, `app:` and `user:` state is not shared
+    across sessions.
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int = 86400, prefix: str = "sql_agent"):
+        self._redis = client
+        self._ttl = ttl
+        self._prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisSessionService":
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _index_key(self, app_name: str, user_id: str) -> str:
+        return f"{self._prefix}:sessions:{app_name}:{user_id}"
+
+    def _session_key(self, app_name: str, user_id: str, session_id: str) -> str:
+        return f"{self._prefix}:session:{app_name}:{user_id}:{session_id}"
+
+    def _touch(
+        self, pipe: redis.client.Pipeline, session: Session, *keys: str
+    ) -> None:
+        index_key = self._index_key(session.app_name, session.user_id)
+        pipe.zadd(index_key, {session.id: session.last_update_time})
+        for key in (index_key, *keys):
+            pipe.expire(key, self._ttl)
+
+    def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = (
+            session_id.strip()
+            if session_id and session_id.strip()
+            else str(uuid.uuid4())
+        )
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=state or {},
+            last_update_time=time.time(),
+        )
+        key = self._session_key(app_name, user_id, session_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(f"{key}:state", f"{key}:events")
+        if session.state:
+            pipe.hset(
+                f"{key}:state",
+                mapping={k: json.dumps(v) for k, v in session.state.items()},
+            )
+        self._touch(pipe, session, f"{key}:state")
+        pipe.execute()
+        return session
+
+    def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        key = self._session_key(app_name, user_id, session_id)
+        start = -config.num_recent_events if config and config.num_recent_events else 0
+        pipe = self._redis.pipeline()
+        pipe.zscore(self._index_key(app_name, user_id), session_id)
+        pipe.hgetall(f"{key}:state")
+        pipe.lrange(f"{key}:events", start, -1)
+        last_update_time, state, events = pipe.execute()
+        if last_update_time is None or last_update_time < time.time() - self._ttl:
+            return None
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state={k.decode(): json.loads(v) for k, v in state.items()},
+            events=[Event.model_validate_json(event) for event in events],
+            last_update_time=last_update_time,
+        )
+        if config and config.after_timestamp:
+            session.events = [
+                event for event in session.events
+                if event.timestamp >= config.after_timestamp
+            ]
+        return session
+
+    def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        index_key = self._index_key(app_name, user_id)
+        pipe = self._redis.pipeline()
+        # Drop sessions whose keys have expired.
+        pipe.zremrangebyscore(index_key, "-inf", f"({time.time() - self._ttl}")
+        pipe.zrange(index_key, 0, -1, withscores=True)
+        _, entries = pipe.execute()
+        return ListSessionsResponse(
+            sessions=[
+                Session(
+                    app_name=app_name,
+                    user_id=user_id,
+                    id=session_id.decode(),
+                    last_update_time=last_update_time,
+                )
+                for session_id, last_update_time in entries
+            ]
+        )
+
+    def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        key = self._session_key(app_name, user_id, session_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(f"{key}:state", f"{key}:events")
+        pipe.zrem(self._index_key(app_name, user_id), session_id)
+        pipe.execute()
+
+    def list_events(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> ListEventsResponse:
+        session = self.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        return ListEventsResponse(events=session.events if session else [])
+
+    def append_event(self, session: Session, event: Event) -> Event:
+        super().append_event(session=session, event=event)
+        if event.partial:
+            return event
+        session.last_update_time = event.timestamp
+        key = self._session_key(session.app_name, session.user_id, session.id)
+        # One transaction per event, so concurrent writers to a session each
+        # add their own event and state keys instead of overwriting the other.
+        pipe = self._redis.pipeline()
+        pipe.rpush(f"{key}:events", event.model_dump_json())
+        state_delta = {
+            k: json.dumps(v)
+            for k, v in (event.actions.state_delta if event.actions else {}).items()
+            if not k.startswith(State.TEMP_PREFIX)
+        }
+        if state_delta:
+            pipe.hset(f"{key}:state", mapping=state_delta)
+        self._touch(pipe, session, f"{key}:state", f"{key}:events")
+        pipe.execute()
+        return event
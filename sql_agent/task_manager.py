@@ -19,7 +19,6 @@ from common.types import (
     SendTaskStreamingResponse,
 )
 from common.server.task_manager import InMemoryTaskManager
-from google.genai import types
 import common.server.utils as utils
 from typing import Union
 import logging
@@ -28,7 +27,11 @@ logger = logging.getLogger(__name__)
 # TODO: Move this class (or these classes) to a common directory
 class AgentWithTaskManager(ABC):
 
+    async def ready(self) -> None:
+        """Waits until the agent can serve requests, without blocking the loop."""
+
     def invoke(self, query, session_id) -> str:
+        from google.genai import types
         session = self._runner.session_service.get_session(
             app_name=self._agent.name, user_id=self._user_id, session_id=session_id
         )
@@ -50,6 +53,8 @@ class AgentWithTaskManager(ABC):
         return "\n".join([p.text for p in events[-1].content.parts if p.text])
 
     async def stream(self, query, session_id) -> AsyncIterable[Dict[str, Any]]:
+        await self.ready()
+        from google.genai import types
         session = self._runner.session_service.get_session(
             app_name=self._agent.name, user_id=self._user_id, session_id=session_id
         )
@@ -63,6 +68,7 @@ class AgentWithTaskManager(ABC):
                 state={},
                 session_id=session_id,
             )
+        final_response = ""
         async for event in self._runner.run_async(
             user_id=self._user_id, session_id=session.id, new_message=content
         ):
@@ -79,14 +85,25 @@ class AgentWithTaskManager(ABC):
                     and event.content.parts
                     and any([True for p in event.content.parts if p.function_response])):
                     response = next((p.function_response.model_dump() for p in event.content.parts))
+                if not response:
+                    # State-only events carry no output to report.
+                    continue
+                # Each sub-agent's final response is streamed as it arrives;
+                # the task only completes once the whole pipeline has run.
+                final_response = response
                 yield {
-                    "is_task_complete": True,
+                    "is_task_complete": False,
                     "content": response,
+                    "author": event.author,
                 }
             else:
                 yield {
                     "is_task_complete": False
                 }
+        yield {
+            "is_task_complete": True,
+            "content": final_response,
+        }
 
 class AgentTaskManager(InMemoryTaskManager):
 
@@ -105,7 +122,14 @@ class AgentTaskManager(InMemoryTaskManager):
             artifacts = None
             if not is_task_complete:
               task_state = TaskState.WORKING
-              parts = [{"type": "text", "text": "Working..."}]
+              if isinstance(item.get("content"), str):
+                parts = [{
+                    "type": "text",
+                    "text": item["content"],
+                    "metadata": {"author": item["author"]},
+                }]
+              else:
+                parts = [{"type": "text", "text": "Working..."}]
             else:
               if isinstance(item["content"], dict):
                 if ("response" in item["content"]
@@ -206,6 +230,7 @@ class AgentTaskManager(InMemoryTaskManager):
         task_send_params: TaskSendParams = request.params
         query = self._get_user_query(task_send_params)
         try:
+            await self.agent.ready()
             result = self.agent.invoke(query, task_send_params.sessionId)
         except Exception as e:
             logger.error(f"Error invoking agent: {e}")
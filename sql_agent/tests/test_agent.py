@@ -0,0 +1,43 @@
+"""Tests for building the SQL agent's runner."""
+
+import asyncio
+import threading
+import time
+
+from agent import SQLAgent
+
+
+class SlowSQLAgent(SQLAgent):
+    def __init__(self):
+        super().__init__()
+        self.builds = 0
+
+    def _build_runner(self):
+        self.builds += 1
+        time.sleep(0.2)
+        return object()
+
+
+def test_ready_waits_for_warm_up_off_the_event_loop():
+    agent = SlowSQLAgent()
+    warm_up = threading.Thread(target=agent.warm_up)
+    warm_up.start()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0.01)
+        await agent.ready()
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) > 5
+    warm_up.join()
+    assert agent.builds == 1
@@ -0,0 +1,47 @@
+"""Tests for the Streamlit A2A client's SSE parsing."""
+
+import asyncio
+
+from chat_interface import A2AClient
+
+
+class FakeResponse:
+    def __init__(self, chunks: list[bytes]):
+        self._chunks = chunks
+
+    async def aiter_bytes(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _parse(chunks: list[bytes]) -> list[dict]:
+    async def main():
+        return [data async for data in A2AClient._iter_sse_data(FakeResponse(chunks))]
+
+    return asyncio.run(main())
+
+
+# As sent by sse-starlette: CRLF line endings and keep-alive comments.
+STREAM = (
+    b'data: {"id": 1, "result": {"final": false}}\r\n\r\n'
+    b": ping\r\n\r\n"
+    b'event: message\r\ndata: {"id": 1, "result": {"final": true}}\r\n\r\n'
+)
+EVENTS = [
+    {"id": 1, "result": {"final": False}},
+    {"id": 1, "result": {"final": True}},
+]
+
+
+def test_parses_events_in_one_chunk():
+    assert _parse([STREAM]) == EVENTS
+
+
+def test_parses_events_split_at_any_byte():
+    # Covers splits inside the JSON payload and between "\r" and "\n".
+    for i in range(1, len(STREAM)):
+        assert _parse([STREAM[:i], STREAM[i:]]) == EVENTS, i
+
+
+def test_parses_byte_by_byte_stream():
+    assert _parse([STREAM[i : i + 1] for i in range(len(STREAM))]) == EVENTS
@@ -0,0 +1,263 @@
+"""Tests for provider call scheduling and request coalescing."""
+
+import asyncio
+import gc
+import threading
+import weakref
+
+import litellm
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+import llm as llm_module
+from llm import (
+    DEFAULT_MODEL,
+    CoalescingLlm,
+    HedgedLlm,
+    PriorityScheduler,
+    ScheduledLlm,
+    supports_json_schema,
+)
+
+
+async def _hold(scheduler: PriorityScheduler, priority: int, order: list, name: str):
+    async with scheduler.slot(priority):
+        order.append(name)
+        await asyncio.sleep(0)
+
+
+def test_scheduler_grants_slots_by_priority_then_arrival():
+    async def main():
+        scheduler = PriorityScheduler(1)
+        order = []
+        async with scheduler.slot(0):
+            tasks = [
+                asyncio.create_task(_hold(scheduler, priority, order, name))
+                for name, priority in [
+                    ("analyzer", 2),
+                    ("refactor", 0),
+                    ("writer", 1),
+                    ("analyzer 2", 2),
+                ]
+            ]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["refactor", "writer", "analyzer", "analyzer 2"]
+
+
+def test_cancelled_waiter_gives_up_its_turn():
+    async def main():
+        scheduler = PriorityScheduler(1)
+        order = []
+        async with scheduler.slot(0):
+            cancelled = asyncio.create_task(_hold(scheduler, 0, order, "cancelled"))
+            waiting = asyncio.create_task(_hold(scheduler, 1, order, "waiting"))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.wait_for(waiting, 1)
+        return scheduler, order
+
+    scheduler, order = asyncio.run(main())
+    assert order == ["waiting"]
+    assert scheduler._available == 1
+    assert not scheduler._waiters
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_released():
+    async def main():
+        scheduler = PriorityScheduler(1)
+        order = []
+        async with scheduler.slot(0):
+            task = asyncio.create_task(_hold(scheduler, 0, order, "cancelled"))
+            await asyncio.sleep(0)
+        # The slot has been handed over, but the waiter has not resumed yet.
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return scheduler, order
+
+    scheduler, order = asyncio.run(main())
+    assert order == []
+    assert scheduler._available == 1
+
+
+def test_slot_is_handed_to_a_waiter_on_another_loop():
+    scheduler = PriorityScheduler(1)
+    held = threading.Event()
+    release = threading.Event()
+    order = []
+
+    async def hold():
+        async with scheduler.slot(0):
+            held.set()
+            await asyncio.to_thread(release.wait)
+
+    # Like two synchronous Runner.run calls, each on a loop of its own.
+    holder = threading.Thread(target=asyncio.run, args=(hold(),))
+    holder.start()
+    held.wait()
+
+    async def wait():
+        task = asyncio.create_task(_hold(scheduler, 0, order, "waiter"))
+        await asyncio.sleep(0)
+        assert order == []
+        release.set()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(wait())
+    holder.join()
+    assert order == ["waiter"]
+    assert scheduler._available == 1
+
+
+class CountingLlm(BaseLlm):
+    calls: int = 0
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        text = llm_request.contents[-1].parts[0].text
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part.from_text(text=text.upper())])
+        )
+
+
+def _request(text: str) -> LlmRequest:
+    return LlmRequest(
+        model="fake",
+        contents=[types.Content(role="user", parts=[types.Part.from_text(text=text)])],
+    )
+
+
+async def _generate(llm: BaseLlm, llm_request: LlmRequest) -> list[str]:
+    return [
+        response.content.parts[0].text
+        async for response in llm.generate_content_async(llm_request)
+    ]
+
+
+def test_identical_in_flight_requests_share_one_call():
+    inner = CountingLlm(model="fake")
+    llm = CoalescingLlm(model="fake", inner=inner)
+
+    async def main():
+        return await asyncio.gather(
+            _generate(llm, _request("count pets")),
+            _generate(llm, _request("count pets")),
+            _generate(llm, _request("count owners")),
+        )
+
+    assert asyncio.run(main()) == [["COUNT PETS"], ["COUNT PETS"], ["COUNT OWNERS"]]
+    assert inner.calls == 2
+
+
+def test_later_identical_request_joins_the_call_in_flight():
+    inner = CountingLlm(model="fake")
+    llm = CoalescingLlm(model="fake", inner=inner)
+
+    async def main():
+        first = asyncio.create_task(_generate(llm, _request("count pets")))
+        await asyncio.sleep(0.005)
+        second = asyncio.create_task(_generate(llm, _request("count pets")))
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [["COUNT PETS"], ["COUNT PETS"]]
+    assert inner.calls == 1
+
+
+def test_cancelled_caller_leaves_the_shared_call_to_the_others():
+    inner = CountingLlm(model="fake")
+    llm = CoalescingLlm(model="fake", inner=inner)
+
+    async def main():
+        cancelled = asyncio.create_task(_generate(llm, _request("count pets")))
+        waiting = asyncio.create_task(_generate(llm, _request("count pets")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await waiting
+
+    assert asyncio.run(main()) == ["COUNT PETS"]
+    assert inner.calls == 1
+
+
+def test_abandoned_request_stops_the_provider_call(monkeypatch):
+    class HangingLlm(BaseLlm):
+        cancelled: bool = False
+
+        async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False):
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+            yield
+
+    scheduler = PriorityScheduler(1)
+    monkeypatch.setattr(llm_module, "_scheduler", scheduler)
+    inner = HangingLlm(model="fake")
+    llm = CoalescingLlm(model="fake", inner=ScheduledLlm(model="fake", inner=inner))
+
+    async def main():
+        task = asyncio.create_task(_generate(llm, _request("count pets")))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert scheduler._available == 1
+    assert inner.cancelled
+
+
+def test_hedged_replicas_hold_a_slot_each(monkeypatch):
+    scheduler = PriorityScheduler(2)
+    monkeypatch.setattr(llm_module, "_scheduler", scheduler)
+    replicas = [CountingLlm(model="fake"), CountingLlm(model="fake")]
+    hedged = HedgedLlm(
+        model="fake",
+        replicas=[ScheduledLlm(model="fake", inner=replica) for replica in replicas],
+    )
+
+    async def main():
+        task = asyncio.create_task(_generate(hedged, _request("count pets")))
+        await asyncio.sleep(0.005)
+        available = scheduler._available
+        return await task, available
+
+    assert asyncio.run(main()) == (["COUNT PETS"], 0)
+    assert [replica.calls for replica in replicas] == [1, 1]
+    assert scheduler._available == 2
+
+
+def test_closed_loops_are_not_kept_alive():
+    llm = CoalescingLlm(model="fake", inner=CountingLlm(model="fake"))
+    loops = []
+
+    async def main():
+        loops.append(weakref.ref(asyncio.get_running_loop()))
+        await _generate(llm, _request("count pets"))
+
+    # Like ADK's synchronous Runner.run, which runs each call on a new loop.
+    for _ in range(3):
+        asyncio.run(main())
+    gc.collect()
+    assert all(loop() is None for loop in loops)
+    assert not llm._calls
+
+
+def test_default_model_keeps_its_json_schema_on_groq():
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": "query_plan", "schema": {"type": "object"}},
+    }
+    params = litellm.GroqChatConfig().map_openai_params(
+        {"response_format": response_format},
+        {},
+        DEFAULT_MODEL.removeprefix("groq/"),
+        drop_params=False,
+    )
+    assert supports_json_schema(DEFAULT_MODEL)
+    assert params["response_format"] == response_format
+    assert "tools" not in params
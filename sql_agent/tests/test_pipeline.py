@@ -0,0 +1,230 @@
+"""Tests for how the speculative pipeline overlaps and cancels its stages."""
+
+import asyncio
+import json
+from typing import Optional
+
+from google.adk.agents import LlmAgent
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from llm import CoalescingLlm
+from pipeline import SpeculativeSQLPipelineAgent, is_complex_question
+from plan_cache import PlanCache
+
+QUESTION = "What is the total amount per customer?"
+PLAN = json.dumps(
+    {
+        "fields": ["customer_id", "amount"],
+        "tables": ["milvus_sales"],
+        "query_plan": ["Group by customer_id", "Sum amount"],
+    }
+)
+MATCHING_SQL = "SELECT customer_id, SUM(amount) FROM milvus_sales GROUP BY customer_id"
+OTHER_SQL = "SELECT COUNT(*) FROM milvus_sales"
+
+
+class FakeLlm(BaseLlm):
+    """Answers with `text` after `delay` seconds, or never if `delay` is None."""
+
+    text: str = ""
+    delay: Optional[float] = 0.0
+    calls: int = 0
+    cancelled: bool = False
+    requests: list[LlmRequest] = []
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False):
+        self.calls += 1
+        self.requests.append(llm_request)
+        try:
+            if self.delay is None:
+                await asyncio.Event().wait()
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part.from_text(text=self.text)])
+        )
+
+
+def _agent(name: str, model: BaseLlm, output_key: str, **kwargs) -> LlmAgent:
+    return LlmAgent(
+        name=name,
+        model=model,
+        instruction="Answer.",
+        output_key=output_key,
+        disallow_transfer_to_parent=True,
+        disallow_transfer_to_peers=True,
+        **kwargs,
+    )
+
+
+def _run(
+    plan: BaseLlm,
+    draft: BaseLlm,
+    writer: BaseLlm,
+    plan_cache: Optional[PlanCache] = None,
+    oneshot: Optional[BaseLlm] = None,
+    question: str = QUESTION,
+) -> tuple[list, dict]:
+    callbacks = {}
+    if plan_cache is not None:
+        callbacks = {
+            "before_model_callback": plan_cache.before_model_callback,
+            "after_model_callback": plan_cache.after_model_callback,
+        }
+    pipeline = SpeculativeSQLPipelineAgent(
+        name="SQLCodePipelineAgent",
+        oneshot_agent=_agent(
+            "sql_oneshot", oneshot or FakeLlm(model="fake"), "refactored_sql_output"
+        ),
+        analyzer_agent=_agent("sql_schema_analyzer", plan, "query_plan", **callbacks),
+        speculative_writer_agent=_agent("sql_speculative_writer", draft, "sql_draft"),
+        writer_agent=_agent("sql_writer", writer, "sql_output"),
+        refactor_agent=_agent(
+            "sql_refactor", FakeLlm(model="fake", text="SELECT 1"), "refactored_sql_output"
+        ),
+    )
+    session_service = InMemorySessionService()
+    session = session_service.create_session(app_name="test", user_id="user")
+    runner = Runner(app_name="test", agent=pipeline, session_service=session_service)
+
+    async def main():
+        message = types.Content(role="user", parts=[types.Part.from_text(text=question)])
+        return [
+            event
+            async for event in runner.run_async(
+                user_id="user", session_id=session.id, new_message=message
+            )
+        ]
+
+    events = asyncio.run(asyncio.wait_for(main(), 5))
+    state = session_service.get_session(
+        app_name="test", user_id="user", session_id=session.id
+    ).state
+    return events, state
+
+
+def test_router_sends_grouping_questions_to_the_pipeline():
+    for question in [
+        QUESTION,
+        "Count customers by city",
+        "List the number of customers for every state",
+        "Show the total amount for each customer",
+        "What is the average order value by month?",
+    ]:
+        assert is_complex_question(question), question
+
+
+def test_router_keeps_simple_questions_simple():
+    for question in [
+        "How many customers are there?",
+        "List customers sorted by name",
+        "Show orders ordered by date",
+        "What is the total amount of sales in 2023?",
+    ]:
+        assert not is_complex_question(question), question
+
+
+def test_simple_question_is_answered_in_one_call():
+    oneshot = FakeLlm(model="fake", text=OTHER_SQL)
+    plan = FakeLlm(model="fake", text=PLAN)
+    draft = FakeLlm(model="fake", text=MATCHING_SQL)
+    writer = FakeLlm(model="fake", text=MATCHING_SQL)
+    events, state = _run(
+        plan=plan,
+        draft=draft,
+        writer=writer,
+        oneshot=oneshot,
+        question="How many sales are there?",
+    )
+    assert [event.author for event in events] == ["sql_oneshot"]
+    assert state["refactored_sql_output"] == OTHER_SQL
+    assert oneshot.calls == 1
+    assert plan.calls == draft.calls == writer.calls == 0
+
+
+def test_drafting_agents_run_on_their_own_branches():
+    events, _ = _run(
+        plan=FakeLlm(model="fake", text=PLAN),
+        draft=FakeLlm(model="fake", text=MATCHING_SQL),
+        writer=FakeLlm(model="fake", text=MATCHING_SQL),
+    )
+    branches = {event.author: event.branch for event in events}
+    # Neither branch is a prefix of the other, so neither agent sees the
+    # other's events.
+    assert branches["sql_schema_analyzer"].startswith(
+        "SQLCodePipelineAgent.sql_schema_analyzer"
+    )
+    assert branches["sql_speculative_writer"].startswith(
+        "SQLCodePipelineAgent.sql_speculative_writer"
+    )
+
+
+def test_writer_does_not_see_the_rejected_draft():
+    writer = FakeLlm(model="fake", text=MATCHING_SQL)
+    events, state = _run(
+        plan=FakeLlm(model="fake", text=PLAN),
+        draft=FakeLlm(model="fake", text=OTHER_SQL),
+        writer=writer,
+    )
+    assert state["sql_output"] == MATCHING_SQL
+    (request,) = writer.requests
+    assert OTHER_SQL not in str(request.contents)
+    assert {event.author: event.branch for event in events}["sql_writer"].startswith(
+        "SQLCodePipelineAgent.sql_writer"
+    )
+
+
+def test_accepted_draft_cancels_the_writer_call():
+    writer = FakeLlm(model="fake", delay=None)
+    _, state = _run(
+        plan=FakeLlm(model="fake", text=PLAN),
+        draft=FakeLlm(model="fake", text=MATCHING_SQL, delay=0.05),
+        writer=CoalescingLlm(model="fake", inner=writer),
+    )
+    assert state["sql_output"] == MATCHING_SQL
+    assert writer.calls == 1
+    assert writer.cancelled
+
+
+def test_finished_writer_cancels_the_draft():
+    draft = FakeLlm(model="fake", delay=None)
+    _, state = _run(
+        plan=FakeLlm(model="fake", text=PLAN),
+        draft=draft,
+        writer=FakeLlm(model="fake", text=MATCHING_SQL),
+    )
+    assert state["sql_output"] == MATCHING_SQL
+    assert draft.cancelled
+
+
+def test_cached_plan_waits_for_the_draft_before_writing():
+    plan_cache = PlanCache("schema")
+    plan_cache.store(QUESTION, PLAN)
+    plan = FakeLlm(model="fake", text=PLAN)
+    writer = FakeLlm(model="fake", text=OTHER_SQL)
+    _, state = _run(
+        plan=plan,
+        draft=FakeLlm(model="fake", text=MATCHING_SQL, delay=0.05),
+        writer=writer,
+        plan_cache=plan_cache,
+    )
+    assert plan.calls == 0
+    assert writer.calls == 0
+    assert state["sql_output"] == MATCHING_SQL
+
+
+def test_cached_plan_rejecting_the_draft_starts_the_writer():
+    plan_cache = PlanCache("schema")
+    plan_cache.store(QUESTION, PLAN)
+    _, state = _run(
+        plan=FakeLlm(model="fake", text=PLAN),
+        draft=FakeLlm(model="fake", text=OTHER_SQL, delay=0.05),
+        writer=FakeLlm(model="fake", text=MATCHING_SQL),
+        plan_cache=plan_cache,
+    )
+    assert state["sql_output"] == MATCHING_SQL
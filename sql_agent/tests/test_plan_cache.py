@@ -0,0 +1,74 @@
+"""Tests for near-duplicate matching in the plan cache."""
+
+from types import SimpleNamespace
+
+from google.genai import types
+
+from plan_cache import PlanCache
+
+QUESTION = "customers in city Austin whose state is not Texas"
+
+
+def _cache(question: str = QUESTION) -> PlanCache:
+    plan_cache = PlanCache("schema")
+    plan_cache.store(question, "plan")
+    return plan_cache
+
+
+def test_rephrasing_reuses_the_plan():
+    question = (
+        "Show the total amount of sales per customer in Austin for customers "
+        "whose lead source is the partner program this year"
+    )
+    plan_cache = _cache(question)
+    assert plan_cache.lookup(question.lower() + "?") == "plan"
+    assert plan_cache.lookup("Please s" + question[1:]) == "plan"
+
+
+def test_swapped_values_miss():
+    assert _cache().lookup("customers in city Texas whose state is not Austin") is None
+
+
+def test_reordered_words_miss():
+    plan_cache = _cache("orders placed by customers referred by partners")
+    assert plan_cache.lookup("orders placed by partners referred by customers") is None
+
+
+def test_added_negation_misses():
+    question = (
+        "list the names and emails of every customer from the sales table "
+        "whose lead source is the partner program and who signed up online"
+    )
+    plan_cache = _cache(question)
+    assert plan_cache.lookup(question.replace("who signed", "who not signed")) is None
+
+
+def test_different_numbers_miss():
+    plan_cache = _cache("customers with more than 5 orders")
+    assert plan_cache.lookup("customers with more than 6 orders") is None
+
+
+def _callback_context(question: str, earlier_turns: int = 0) -> SimpleNamespace:
+    events = [SimpleNamespace(invocation_id=f"turn {i}") for i in range(earlier_turns)]
+    events.append(SimpleNamespace(invocation_id="current"))
+    return SimpleNamespace(
+        user_content=types.Content(role="user", parts=[types.Part.from_text(text=question)]),
+        state={},
+        _invocation_context=SimpleNamespace(
+            invocation_id="current", session=SimpleNamespace(events=events)
+        ),
+    )
+
+
+def test_follow_up_questions_bypass_the_cache():
+    plan_cache = _cache("now only the active ones")
+    callback_context = _callback_context("now only the active ones", earlier_turns=1)
+    assert plan_cache.before_model_callback(callback_context, None) is None
+    assert callback_context.state["query_plan_cached"] is False
+
+
+def test_first_question_is_served_from_the_cache():
+    callback_context = _callback_context(QUESTION)
+    response = _cache().before_model_callback(callback_context, None)
+    assert response.content.parts[0].text == "plan"
+    assert callback_context.state["query_plan_cached"] is True
@@ -0,0 +1,88 @@
+"""Round-trip tests for the Redis session service, against fakeredis."""
+
+import fakeredis
+from google.adk.events import Event, EventActions
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types
+
+from redis_session_service import RedisSessionService
+
+SESSION = {"app_name": "app", "user_id": "user", "session_id": "s1"}
+
+
+def _event(text: str, timestamp: float, state_delta: dict = None) -> Event:
+    return Event(
+        invocation_id=text,
+        author="user",
+        content=types.Content(role="user", parts=[types.Part.from_text(text=text)]),
+        actions=EventActions(state_delta=state_delta or {}),
+        timestamp=timestamp,
+    )
+
+
+def _texts(events: list[Event]) -> list[str]:
+    return [event.content.parts[0].text for event in events]
+
+
+def test_session_round_trip():
+    service = RedisSessionService(fakeredis.FakeRedis())
+    created = service.create_session(
+        app_name="app", user_id="user", session_id="s1", state={"dialect": "sqlite"}
+    )
+    now = created.last_update_time
+
+    session = service.get_session(**SESSION)
+    assert session.state == {"dialect": "sqlite"}
+    assert session.events == []
+
+    service.append_event(session, _event("first", now + 1, {"query_plan": {"fields": []}}))
+    service.append_event(
+        session, _event("second", now + 2, {"sql_output": "SELECT 1", "temp:x": 1})
+    )
+
+    session = service.get_session(**SESSION)
+    assert _texts(session.events) == ["first", "second"]
+    assert session.state == {
+        "dialect": "sqlite",
+        "query_plan": {"fields": []},
+        "sql_output": "SELECT 1",
+    }
+    assert session.last_update_time == now + 2
+    assert _texts(service.list_events(**SESSION).events) == ["first", "second"]
+
+    recent = service.get_session(**SESSION, config=GetSessionConfig(num_recent_events=1))
+    assert _texts(recent.events) == ["second"]
+    later = service.get_session(
+        **SESSION, config=GetSessionConfig(after_timestamp=now + 1.5)
+    )
+    assert _texts(later.events) == ["second"]
+
+    (listed,) = service.list_sessions(app_name="app", user_id="user").sessions
+    assert (listed.id, listed.last_update_time, listed.events) == ("s1", now + 2, [])
+
+    service.delete_session(**SESSION)
+    assert service.get_session(**SESSION) is None
+    assert service.list_events(**SESSION).events == []
+    assert service.list_sessions(app_name="app", user_id="user").sessions == []
+
+
+def test_concurrent_writers_keep_each_others_events_and_state():
+    client = fakeredis.FakeRedis()
+    service = RedisSessionService(client)
+    created = service.create_session(app_name="app", user_id="user", session_id="s1")
+    now = created.last_update_time
+
+    # Two processes holding their own copy of the same session.
+    first = RedisSessionService(client).get_session(**SESSION)
+    second = RedisSessionService(client).get_session(**SESSION)
+    service.append_event(first, _event("first", now + 1, {"a": 1}))
+    service.append_event(second, _event("second", now + 2, {"b": 2}))
+
+    session = service.get_session(**SESSION)
+    assert _texts(session.events) == ["first", "second"]
+    assert session.state == {"a": 1, "b": 2}
+
+
+def test_missing_session_is_none():
+    service = RedisSessionService(fakeredis.FakeRedis())
+    assert service.get_session(**SESSION) is None
@@ -0,0 +1,12 @@
+"""Helpers shared by the SQL agent's pipeline and callbacks."""
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+
+
+def user_question(context: CallbackContext | InvocationContext) -> str:
+    """Returns the text of the user message that started the invocation."""
+    content = context.user_content
+    if not content or not content.parts:
+        return ""
+    return "\n".join(part.text for part in content.parts if part.text)